@@ -22,8 +22,15 @@ logger = logging.getLogger(__name__)
 
 # Percorso del file CSV e database DuckDB
 # Se non definiti nel .env, usiamo valori predefiniti
+# Lo script carica, esegue una query ed esce: di default lavoriamo in memoria
+# (':memory:') e non scriviamo nulla su disco. Indicando un file in DUCKDB_DB_FILE
+# i dati restano salvati, al prezzo delle scritture su disco durante il caricamento.
 CSV_FILE = os.getenv('CSV_FILE_2000', 'esercizi/input_2000.csv')
-DB_FILE = os.getenv('DUCKDB_DB_FILE', 'utenti.duckdb')
+DB_FILE = os.getenv('DUCKDB_DB_FILE', ':memory:')
+
+# Limite di memoria per DuckDB (facoltativo): se non è impostato lasciamo
+# il valore predefinito di DuckDB, che si basa sulla RAM della macchina
+MEMORY_LIMIT = os.getenv('DUCKDB_MEMORY_LIMIT')
 
 def create_connection():
     """Crea una connessione al database DuckDB.
@@ -34,6 +41,16 @@ def create_connection():
     try:
         logger.info(f"Connessione al database DuckDB {DB_FILE}...")
         conn = duckdb.connect(DB_FILE)
+        
+        # DuckDB usa già tutti i core per leggere il CSV in parallelo.
+        # Il limite di memoria lo cambiamo solo se l'utente lo ha chiesto esplicitamente
+        if MEMORY_LIMIT:
+            conn.execute(f"SET memory_limit = '{MEMORY_LIMIT}'")
+        
+        # Con un database su file alziamo la soglia di checkpoint automatico,
+        # così il caricamento non viene interrotto da checkpoint intermedi
+        if DB_FILE != ':memory:':
+            conn.execute("SET wal_autocheckpoint = '1GB'")
         logger.info("Connessione stabilita con successo.")
         return conn
     except Exception as e:
@@ -55,7 +72,7 @@ def get_csv_header(csv_file):
         logger.error(f"Errore durante la lettura dell'intestazione CSV: {e}")
         raise
 
-def load_csv_to_database(conn, csv_file):
+def load_csv_to_database(conn, csv_file, header):
     """Carica i dati dal CSV nel database DuckDB.
     
     PASSAGGIO CHIAVE: La vera potenza di DuckDB è qui. A differenza di altri DB,
@@ -65,32 +82,26 @@ def load_csv_to_database(conn, csv_file):
     try:
         logger.info(f"Caricamento dati dal file {csv_file}...")
         
-        # OTTIMIZZAZIONE IMPORTANTE: DuckDB può creare una vista diretta sul CSV!
-        # Questo è molto più efficiente di un caricamento manuale riga per riga
-        conn.execute(f"""
-            CREATE OR REPLACE VIEW csv_data AS
-            SELECT * FROM read_csv_auto('{csv_file}', header=true);
-        """)
-        
-        # Contiamo quante righe ci sono nel CSV
-        result = conn.execute("SELECT COUNT(*) FROM csv_data").fetchone()
+        # OTTIMIZZAZIONE: conosciamo già l'intestazione, quindi diciamo noi a DuckDB
+        # quali colonne aspettarsi (tutte VARCHAR) e disattiviamo l'auto-rilevamento.
+        # Così DuckDB non deve fare una prima passata sul file per indovinare i tipi.
+        columns = ', '.join(
+            "'{}': 'VARCHAR'".format(col.replace("'", "''")) for col in header
+        )
+        logger.info(f"Lettura del CSV con {len(header)} colonne VARCHAR")
+        
+        # TECNICA DI CARICAMENTO: Una sola istruzione legge il CSV e crea la tabella,
+        # senza passare da una vista intermedia. Il risultato è il numero di righe inserite.
+        result = conn.execute(f"""
+            CREATE OR REPLACE TABLE utenti AS
+            SELECT * FROM read_csv('{csv_file}', header=true, auto_detect=false,
+                                   columns={{{columns}}});
+        """).fetchone()
         total_rows = result[0]
-        logger.info(f"File CSV letto con {total_rows} righe")
-        
-        # Vediamo quali colonne ha rilevato DuckDB
-        # DuckDB è intelligente nell'inferire i tipi di dato automaticamente
-        table_info = conn.execute("PRAGMA table_info(csv_data)").fetchall()
-        logger.info(f"La vista CSV ha {len(table_info)} colonne")
         
-        # TECNICA DI CARICAMENTO: Invece di caricare ogni riga, possiamo
-        # semplicemente creare una tabella dal contenuto della vista
-        # Questo è estremamente più veloce di un inserimento riga per riga
-        conn.execute("DROP TABLE IF EXISTS utenti")
-        conn.execute("CREATE TABLE utenti AS SELECT * FROM csv_data")
-        
-        # Verifichiamo quante righe sono state inserite
-        result = conn.execute("SELECT COUNT(*) FROM utenti").fetchone()
-        total_rows = result[0]
+        # Su file facciamo un unico checkpoint alla fine del caricamento
+        if DB_FILE != ':memory:':
+            conn.execute("CHECKPOINT")
         
         logger.info(f"Caricamento completato: {total_rows} righe inserite nella tabella utenti.")
         return total_rows
@@ -98,29 +109,54 @@ def load_csv_to_database(conn, csv_file):
         logger.error(f"Errore durante il caricamento dei dati: {e}")
         raise
 
-def count_info_domain_websites(conn):
+def find_website_column(header, lower_names):
+    """Trova la colonna che contiene i siti web partendo dall'intestazione del CSV.
+    
+    ROBUSTEZZA: la colonna potrebbe non chiamarsi esattamente 'website'.
+    Usiamo l'intestazione già letta in main(), così non serve interrogare
+    PRAGMA table_info. I confronti si fanno sui nomi già in minuscolo (lower_names),
+    ma restituiamo il nome originale, perché DuckDB usa i nomi del CSV così come sono.
+    """
+    for col, col_name in zip(header, lower_names):
+        if col_name == 'website' or 'site' in col_name or 'sito' in col_name:
+            return col
+    return None
+
+def like_predicate(column, pattern):
+    """Traduce un pattern LIKE nella funzione DuckDB più specifica possibile.
+    
+    Il pattern lo conosciamo già in Python, quindi possiamo scegliere prima
+    l'operatore giusto in base alla sua forma: '%x' diventa ends_with,
+    'x%' starts_with e '%x%' contains. Tutto il resto resta un LIKE normale.
+    """
+    literal = pattern.strip('%')
+    # Il trucco vale solo se il testo centrale non contiene altri caratteri jolly
+    # (né il carattere di escape del LIKE)
+    if '%' in literal or '_' in literal or '\\' in literal or not literal:
+        return "\"{}\" LIKE '{}'".format(column, pattern.replace("'", "''"))
+    
+    quoted = "'{}'".format(literal.replace("'", "''"))
+    starts = pattern.startswith('%')
+    ends = pattern.endswith('%')
+    if starts and ends:
+        return f'contains("{column}", {quoted})'
+    if starts:
+        return f'ends_with("{column}", {quoted})'
+    if ends:
+        return f'starts_with("{column}", {quoted})'
+    return f'"{column}" = {quoted}'
+
+def count_info_domain_websites(conn, website_col):
     """Conta quanti link in Website sono del dominio di primo livello 'info'
     
     PARTE CRUCIALE: questa funzione implementa la query richiesta nell'esercizio.
-    Ho scritto codice robusto che funziona anche se la colonna non si chiama
-    esattamente 'website' ma qualcosa di simile.
+    La colonna dei siti web viene individuata una sola volta in main()
+    con find_website_column e ci arriva già pronta.
     """
     try:
         logger.info("Esecuzione query per contare website con dominio di primo livello 'info'...")
         
-        # ROBUSTEZZA: Prima troviamo quale colonna contiene i siti web
-        # Questo rende lo script più flessibile rispetto a variazioni nel CSV
-        table_info = conn.execute("PRAGMA table_info(utenti)").fetchall()
-        website_col = None
-        
-        # Cerchiamo colonne che potrebbero contenere URL di siti web
-        for col in table_info:
-            col_name = col[1].lower()
-            if col_name == 'website' or 'site' in col_name or 'sito' in col_name:
-                website_col = col[1]
-                break
-        
-        # Se non troviamo colonne adatte, non possiamo procedere
+        # Se non abbiamo trovato colonne adatte, non possiamo procedere
         if not website_col:
             logger.error("Colonna 'website' non trovata nella tabella")
             return 0
@@ -128,9 +164,12 @@ def count_info_domain_websites(conn):
         # QUERY FINALE: Contiamo i siti con dominio .info
         # Nota: usiamo due condizioni perché un URL potrebbe essere
         # esempio.info oppure esempio.info/pagina
+        # OTTIMIZZAZIONE: like_predicate trasforma i due LIKE ('%.info' e '%.info/%')
+        # in ends_with e contains, che DuckDB esegue con funzioni specializzate
+        # invece del motore generico del LIKE
         query = f"""
             SELECT COUNT(*) FROM utenti
-            WHERE "{website_col}" LIKE '%.info' OR "{website_col}" LIKE '%.info/%';
+            WHERE {like_predicate(website_col, '%.info')} OR {like_predicate(website_col, '%.info/%')};
         """
         
         result = conn.execute(query).fetchone()
@@ -163,14 +202,18 @@ def main():
         header = get_csv_header(CSV_FILE)
         logger.info(f"Il file CSV ha {len(header)} colonne")
         
+        # Nomi delle colonne in minuscolo, calcolati una volta sola
+        lower_names = tuple(col.lower() for col in header)
+        website_col = find_website_column(header, lower_names)
+        
         # Fase 2: Connessione al database
         conn = create_connection()
         
         # Fase 3: Caricamento dei dati
-        rows_loaded = load_csv_to_database(conn, CSV_FILE)
+        rows_loaded = load_csv_to_database(conn, CSV_FILE, header)
         
         # Fase 4: Esecuzione della query richiesta
-        info_domains_count = count_info_domain_websites(conn)
+        info_domains_count = count_info_domain_websites(conn, website_col)
         
         # Fase 5: Visualizzazione dei risultati
         print("\nRISULTATI:")
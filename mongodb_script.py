@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 
 import pymongo   # Libreria per MongoDB
+from pymongo import WriteConcern  # Per le scritture senza conferma durante il caricamento
 import csv       # Per la lettura dei file CSV
 import time      # Per misurare i tempi di esecuzione
 import os        # Per operazioni sui file
@@ -30,6 +31,9 @@ COLLECTION_NAME = os.getenv('MONGO_COLLECTION', 'utenti')
 # Percorso del file CSV da processare
 CSV_FILE = os.getenv('CSV_FILE_8000', 'esercizi/input_8000.csv')
 
+# Numero di documenti per ogni insert_many (ben sotto i limiti di un singolo comando)
+BATCH_SIZE = 10000
+
 def connect_to_mongodb():
     """Connessione a MongoDB.
     
@@ -63,7 +67,59 @@ def drop_collection(db):
         logger.error(f"Errore durante l'eliminazione della collection: {e}")
         raise
 
-def load_csv_to_mongodb(db, csv_file):
+def get_csv_header(csv_file):
+    """Ottiene l'intestazione dal file CSV.
+    
+    La leggiamo una sola volta all'inizio: ci serve sia per costruire
+    i documenti sia per capire quale campo contiene la data di sottoscrizione.
+    """
+    try:
+        with open(csv_file, 'r', encoding='utf-8') as f:
+            csv_reader = csv.reader(f)
+            header = next(csv_reader)  # Leggiamo solo la prima riga
+            return header
+    except Exception as e:
+        logger.error(f"Errore durante la lettura dell'intestazione CSV: {e}")
+        raise
+
+def find_subscription_date_field(header, lower_names):
+    """Trova il campo con la data di sottoscrizione partendo dall'intestazione del CSV.
+    
+    ROBUSTEZZA: il campo potrebbe non chiamarsi esattamente "Subscription Date".
+    Usando l'intestazione non serve leggere un documento di esempio con find_one().
+    I confronti si fanno sui nomi già in minuscolo (lower_names), ma restituiamo
+    il nome originale, perché i documenti usano i nomi del CSV come chiavi.
+    """
+    for field, field_lower in zip(header, lower_names):
+        # Cerchiamo campi che sembrano contenere date di sottoscrizione
+        if ('subscription' in field_lower or 'iscrizione' in field_lower) and ('date' in field_lower or 'data' in field_lower):
+            return field
+    return None
+
+def parse_date(value):
+    """Converte una data 'AAAA-MM-GG' del CSV in un datetime di Python.
+    
+    datetime.fromisoformat è implementata in C ed è molto più veloce di strptime,
+    che resta come ripiego per le date non perfettamente ISO (es. '2020-8-6').
+    Le stringhe vuote diventano None, i valori non validi restano come sono.
+    """
+    if not value:
+        return None
+    # ATTENZIONE: fromisoformat accetta anche '20200826', '2020-W35-3', orari e
+    # fusi orari. La usiamo solo sulla forma esatta AAAA-MM-GG, così i valori
+    # accettati sono gli stessi di strptime("%Y-%m-%d")
+    if len(value) == 10 and value[4] == '-' and value[7] == '-':
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            pass
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        # Se il formato non è corretto, manteniamo il valore originale
+        return value
+
+def load_csv_to_mongodb(db, csv_file, header, lower_names):
     """Carica i dati dal CSV in MongoDB.
     
     PASSAGGIO CHIAVE: a differenza dei database SQL, MongoDB è schema-less,
@@ -71,49 +127,68 @@ def load_csv_to_mongodb(db, csv_file):
     Ma dobbiamo comunque fare attenzione ai tipi di dato, specialmente le date.
     """
     try:
-        collection = db[COLLECTION_NAME]
+        # OTTIMIZZAZIONE: usiamo la collection con write concern w=0 e j=False, cioè
+        # il client non aspetta né la conferma del server né la scrittura sul journal
+        # per ogni blocco di documenti. Vale solo per questo oggetto: la query finale
+        # usa una collection separata con conferma (w=1).
+        collection = db.get_collection(COLLECTION_NAME, write_concern=WriteConcern(w=0, j=False))
         logger.info(f"Caricamento dati dal file {csv_file}...")
         
         # Contatore per il report finale
         total_rows = 0
-        documents = []
         
-        with open(csv_file, 'r', encoding='utf-8') as f:
+        # OTTIMIZZAZIONE: il buffer dei documenti ha già la dimensione di un batch
+        # e viene riutilizzato: scriviamo nella posizione idx invece di fare append
+        # e di ricreare la lista dopo ogni insert_many
+        documents = [None] * BATCH_SIZE
+        idx = 0
+        
+        # OTTIMIZZAZIONE: buffer di lettura da 1 MB invece degli 8 KB predefiniti,
+        # così il modulo csv (che è scritto in C) riceve blocchi più grandi.
+        # newline='' è la modalità raccomandata dalla documentazione del modulo csv.
+        with open(csv_file, 'r', encoding='utf-8', newline='', buffering=1 << 20) as f:
             csv_reader = csv.reader(f)
-            header = next(csv_reader)  # Legge la prima riga (intestazione)
+            next(csv_reader)  # Saltiamo l'intestazione, già letta in main()
+            
+            # OTTIMIZZAZIONE: capiamo UNA VOLTA SOLA quali colonne contengono date,
+            # invece di rifare il controllo sul nome per ogni cella di ogni riga
+            header_tuple = tuple(header)
+            date_keys = tuple(c for c, n in zip(header, lower_names) if 'date' in n or 'data' in n)
             
             # Per ogni riga del CSV, creiamo un documento MongoDB
             for row in csv_reader:
                 # APPROCCIO DINAMICO: creiamo il documento usando i nomi delle colonne dal header
                 # Questo è meglio che usare indici fissi (row[0], row[1], ecc.) perché è più robusto
-                # se la struttura del CSV cambia
-                doc = {}
-                for i, col_name in enumerate(header):
-                    if i < len(row):  # Proteggiamo contro righe più corte del header
-                        value = row[i]
-                        # GESTIONE SPECIALE DELLE DATE: se la colonna sembra contenere una data
-                        # proviamo a convertirla nel formato datetime di Python
-                        if 'date' in col_name.lower() or 'data' in col_name.lower():
-                            try:
-                                value = datetime.strptime(value, "%Y-%m-%d") if value else None
-                            except ValueError:
-                                # Se il formato non è corretto, manteniamo il valore originale
-                                pass
-                        doc[col_name] = value
+                # se la struttura del CSV cambia. dict(zip(...)) lavora tutto in C e si ferma
+                # da solo alla sequenza più corta, quindi protegge anche dalle righe corte.
+                doc = dict(zip(header_tuple, row))
                 
-                documents.append(doc)
+                # GESTIONE SPECIALE DELLE DATE: convertiamo solo le colonne con le date
+                for key in date_keys:
+                    if key in doc:
+                        doc[key] = parse_date(doc[key])
+                
+                documents[idx] = doc
+                idx += 1
                 total_rows += 1
                 
-                # OTTIMIZZAZIONE: Inseriamo in batch di 1000 documenti
-                # Molto più efficiente che inserire un documento alla volta
-                if len(documents) >= 1000:
-                    collection.insert_many(documents)
+                # OTTIMIZZAZIONE: Inseriamo in batch di BATCH_SIZE documenti
+                # Molto più efficiente che inserire un documento alla volta.
+                # Con ordered=False il server non deve rispettare l'ordine
+                # e non si ferma al primo errore.
+                if idx == BATCH_SIZE:
+                    collection.insert_many(documents, ordered=False)
                     logger.info(f"Caricati {total_rows} documenti...")
-                    documents = []
+                    idx = 0
+        
+        # Inseriamo i documenti rimanenti (meno di BATCH_SIZE)
+        if idx:
+            collection.insert_many(documents[:idx], ordered=False)
         
-        # Inseriamo i documenti rimanenti (meno di 1000)
-        if documents:
-            collection.insert_many(documents)
+        # Le scritture senza conferma non ci dicono quando il server ha finito:
+        # il server elabora in ordine i comandi di una connessione, quindi un comando
+        # con risposta (ping) torna solo dopo che gli inserimenti sono stati elaborati
+        db.command('ping')
             
         logger.info(f"Caricamento completato: {total_rows} documenti inseriti.")
         return total_rows
@@ -121,31 +196,32 @@ def load_csv_to_mongodb(db, csv_file):
         logger.error(f"Errore durante il caricamento dei dati: {e}")
         raise
 
-def count_2020_subscriptions(db):
+def create_date_index(db, date_field):
+    """Crea un indice sul campo con la data di sottoscrizione.
+    
+    Senza indice il conteggio per intervallo deve leggere tutti i documenti
+    (COLLSCAN). Lo creiamo dopo il caricamento, così gli inserimenti
+    non devono aggiornarlo documento per documento.
+    """
+    try:
+        logger.info(f"Creazione indice sul campo '{date_field}'...")
+        db[COLLECTION_NAME].create_index([(date_field, pymongo.ASCENDING)])
+    except Exception as e:
+        logger.error(f"Errore durante la creazione dell'indice: {e}")
+        raise
+
+def count_2020_subscriptions(db, date_field):
     """Conta quante 'Subscription Date' sono dell'anno 2020.
     
     PARTE CRUCIALE: questa funzione implementa la query richiesta.
-    L'ho resa robusta cercando il campo con la data di sottoscrizione
-    anche se non si chiama esattamente "Subscription Date".
+    Il campo con la data di sottoscrizione viene individuato una sola volta
+    in main() con find_subscription_date_field e ci arriva già pronto.
     """
     try:
-        collection = db[COLLECTION_NAME]
+        # Per la query torniamo a un write concern con conferma (w=1)
+        collection = db.get_collection(COLLECTION_NAME, write_concern=WriteConcern(w=1))
         logger.info("Esecuzione query per contare iscrizioni del 2020...")
         
-        # ROBUSTEZZA: Prima troviamo il campo che contiene le date di sottoscrizione
-        # MongoDB è schema-less, quindi non possiamo fare come in SQL
-        document_example = collection.find_one()
-        date_field = None
-        
-        if document_example:
-            # Esaminiamo tutti i campi del primo documento
-            for field in document_example:
-                field_lower = field.lower()
-                # Cerchiamo campi che sembrano contenere date di sottoscrizione
-                if ('subscription' in field_lower or 'iscrizione' in field_lower) and ('date' in field_lower or 'data' in field_lower):
-                    date_field = field
-                    break
-        
         if not date_field:
             logger.error("Campo con data di sottoscrizione non trovato")
             return 0
@@ -153,16 +229,33 @@ def count_2020_subscriptions(db):
         # Definiamo l'intervallo di date per il 2020
         # Nota: in MongoDB, le query di confronto sulle date funzionano
         # solo se sono oggetti datetime di Python
+        # Usiamo un intervallo semiaperto [1/1/2020, 1/1/2021): così non perdiamo
+        # date come 31/12/2020 23:59:59.5 e i limiti dell'indice sono esatti
         start_date = datetime(2020, 1, 1)
-        end_date = datetime(2020, 12, 31, 23, 59, 59)
+        end_date = datetime(2021, 1, 1)
+        
+        # CONTROLLO: se qualche data non è stata convertita in datetime durante il
+        # caricamento è rimasta una stringa, e la query qui sotto non la conterebbe.
+        # Meglio segnalarlo invece di restituire silenziosamente un numero sbagliato.
+        unparsed = collection.count_documents({date_field: {"$type": "string"}})
+        if unparsed:
+            logger.warning(f"{unparsed} documenti hanno '{date_field}' come testo e non come data")
         
         # QUERY MONGODB: Contiamo i documenti con data di sottoscrizione nel 2020
-        result = collection.count_documents({
-            date_field: {
-                "$gte": start_date,  # maggiore o uguale alla data di inizio
-                "$lte": end_date     # minore o uguale alla data di fine
-            }
-        })
+        # Usiamo una pipeline di aggregazione: $match filtra (usando l'indice sulla data)
+        # e $count conta direttamente sul server. $type garantisce di confrontare solo date.
+        pipeline = [
+            {"$match": {
+                date_field: {
+                    "$type": "date",
+                    "$gte": start_date,  # maggiore o uguale alla data di inizio
+                    "$lt": end_date      # strettamente minore dell'inizio del 2021
+                }
+            }},
+            {"$count": "n"}
+        ]
+        # Se nessun documento passa il $match, $count non restituisce nulla
+        result = next(collection.aggregate(pipeline), {"n": 0})["n"]
         
         logger.info(f"Numero di iscrizioni del 2020: {result}")
         return result
@@ -188,19 +281,31 @@ def main():
     
     client = None
     try:
-        # Fase 1: Connessione a MongoDB
+        # Fase 1: Analisi del CSV
+        header = get_csv_header(CSV_FILE)
+        logger.info(f"Il file CSV ha {len(header)} colonne")
+        
+        # Nomi delle colonne in minuscolo, calcolati una volta sola
+        lower_names = tuple(col.lower() for col in header)
+        date_field = find_subscription_date_field(header, lower_names)
+        
+        # Fase 2: Connessione a MongoDB
         client, db = connect_to_mongodb()
         
-        # Fase 2: Pulizia della collection esistente
+        # Fase 3: Pulizia della collection esistente
         drop_collection(db)
         
-        # Fase 3: Caricamento dei dati dal CSV
-        rows_loaded = load_csv_to_mongodb(db, CSV_FILE)
+        # Fase 4: Caricamento dei dati dal CSV
+        rows_loaded = load_csv_to_mongodb(db, CSV_FILE, header, lower_names)
+        
+        # Fase 5: Indice sulla data di sottoscrizione
+        if date_field:
+            create_date_index(db, date_field)
         
-        # Fase 4: Esecuzione della query richiesta
-        subscriptions_2020 = count_2020_subscriptions(db)
+        # Fase 6: Esecuzione della query richiesta
+        subscriptions_2020 = count_2020_subscriptions(db, date_field)
         
-        # Fase 5: Visualizzazione dei risultati
+        # Fase 7: Visualizzazione dei risultati
         print("\nRISULTATI:")
         print(f"Totale documenti caricati: {rows_loaded}")
         print(f"Iscrizioni del 2020: {subscriptions_2020}")
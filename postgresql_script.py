@@ -2,7 +2,9 @@
 # -*- coding: utf-8 -*-
 
 import psycopg2  # Libreria per connettersi a PostgreSQL
+import psycopg2.errors  # Classi di eccezione per codice SQLSTATE (es. 22P04)
 import csv       # Per la gestione dei file CSV
+import io        # Per il buffer in memoria usato dal COPY di ripiego
 import time      # Per misurare il tempo di esecuzione
 import os        # Per operazioni sui file e percorsi
 import logging   # Per i log delle operazioni
@@ -33,6 +35,9 @@ DB_PARAMS = {
 # Percorso del file CSV da processare
 CSV_FILE = os.getenv('CSV_FILE_5000', 'esercizi/input_5000.csv')
 
+# Numero di righe per ogni blocco inviato con COPY (usato solo se il COPY diretto del file non va a buon fine)
+BATCH_SIZE = 50000
+
 def get_csv_column_count(csv_file):
     """Ottiene il numero di colonne e l'intestazione dal file CSV.
     
@@ -48,7 +53,7 @@ def get_csv_column_count(csv_file):
         logger.error(f"Errore durante la lettura dell'intestazione CSV: {e}")
         raise
 
-def create_table(conn, header):
+def create_table(conn, safe_names):
     """Crea la tabella nel database in base alle colonne del CSV.
     
     NOTA IMPORTANTE: Invece di hardcodare i nomi delle colonne, creiamo 
@@ -65,22 +70,25 @@ def create_table(conn, header):
         # PASSAGGIO CRITICO: Creiamo la tabella dinamicamente basandoci sull'intestazione del CSV
         # Aggiungiamo anche un ID autoincrementante come chiave primaria
         column_defs = ["id SERIAL PRIMARY KEY"]
-        for col_name in header:
-            # Sanitizziamo il nome della colonna (spazi e maiuscole possono causare problemi)
-            safe_col_name = col_name.lower().replace(' ', '_')
-            column_defs.append(f"{safe_col_name} VARCHAR(255)")
+        # I nomi arrivano già sanitizzati da main() (minuscolo, spazi sostituiti da _)
+        for safe_col_name in safe_names:
+            # TIPI DI DATO: tutte le colonne sono TEXT. In PostgreSQL TEXT è memorizzato
+            # come VARCHAR ma senza il controllo sulla lunghezza massima a ogni riga inserita.
+            # ROBUSTEZZA: non tipizziamo le date, così un solo valore non valido
+            # non blocca il caricamento (come MongoDB, che lo lascia come stringa)
+            column_defs.append(f"{safe_col_name} TEXT")
         
         # Costruiamo e eseguiamo la query SQL per creare la tabella
         create_sql = f"CREATE TABLE utenti ({', '.join(column_defs)});"
         cursor.execute(create_sql)
         
         conn.commit()  # Confermo le modifiche
-        logger.info(f"Tabella creata con successo con {len(header)} colonne.")
+        logger.info(f"Tabella creata con successo con {len(safe_names)} colonne.")
     except Exception as e:
         logger.error(f"Errore durante la creazione della tabella: {e}")
         raise
 
-def load_csv_to_database(conn, csv_file, header):
+def load_csv_to_database(conn, csv_file, safe_names):
     """Carica i dati dal CSV nel database PostgreSQL.
     
     Questa è la funzione più "pesante" in termini di tempo di esecuzione,
@@ -90,32 +98,31 @@ def load_csv_to_database(conn, csv_file, header):
         cursor = conn.cursor()
         logger.info(f"Caricamento dati dal file {csv_file}...")
         
-        # Contatore per tracciare l'avanzamento
-        total_rows = 0
-        
-        # OTTIMIZZAZIONE: Generiamo la query INSERT dinamicamente
-        # basata sul numero di colonne nel CSV
-        column_names = ', '.join([col.lower().replace(' ', '_') for col in header])
-        placeholders = ', '.join(['%s' for _ in header])  # PostgreSQL usa %s per i parametri
-        insert_sql = f"INSERT INTO utenti ({column_names}) VALUES ({placeholders})"
+        # Manteniamo gli stessi nomi di colonna usati in create_table
+        column_names = ', '.join(safe_names)
         
-        # Apriamo il file e iniziamo a processarlo
-        with open(csv_file, 'r', encoding='utf-8') as f:
-            csv_reader = csv.reader(f)
-            next(csv_reader)  # Saltiamo la riga di intestazione
+        # OTTIMIZZAZIONE: invece di un INSERT per ogni riga usiamo COPY ... FROM STDIN.
+        # Il file viene inviato al server così com'è e PostgreSQL lo interpreta da solo:
+        # una sola istruzione al posto di migliaia di round-trip e di parsing lato server.
+        # HEADER TRUE dice a PostgreSQL di saltare la riga di intestazione.
+        copy_sql = f"COPY utenti ({column_names}) FROM STDIN WITH (FORMAT CSV, HEADER TRUE)"
+        try:
+            with open(csv_file, 'r', encoding='utf-8') as f:
+                cursor.copy_expert(sql=copy_sql, file=f)
             
-            # Processiamo ogni riga del CSV e la inseriamo nel database
-            for row in csv_reader:
-                cursor.execute(insert_sql, row)
-                total_rows += 1
-                
-                # Facciamo commit ogni 1000 righe per bilanciare
-                # performance e uso della memoria
-                if total_rows % 1000 == 0:
-                    logger.info(f"Caricate {total_rows} righe...")
-                    conn.commit()
-        
-        # Commit finale per le righe rimanenti
+            # Dopo un COPY, rowcount contiene il numero di righe caricate
+            total_rows = cursor.rowcount
+        except psycopg2.errors.BadCopyFileFormat as e:
+            # PIANO B: il COPY rifiuta il file se qualche riga ha un numero di campi
+            # diverso dall'intestazione (errore 22P04). In quel caso sistemiamo
+            # le righe in Python e le inviamo a blocchi. Gli altri errori sui dati
+            # (date non valide, valori troppo lunghi...) il ripiego non li potrebbe
+            # correggere, quindi li lasciamo arrivare al gestore generale.
+            logger.warning(f"COPY non riuscito ({e}), uso il COPY a blocchi...")
+            conn.rollback()
+            total_rows = copy_rows_in_batches(cursor, csv_file, safe_names, column_names)
+        
+        # Un solo commit alla fine: il caricamento è un'unica transazione
         conn.commit()
         logger.info(f"Caricamento completato: {total_rows} righe inserite.")
         return total_rows
@@ -123,44 +130,107 @@ def load_csv_to_database(conn, csv_file, header):
         logger.error(f"Errore durante il caricamento dei dati: {e}")
         raise
 
-def count_com_emails(conn):
+def copy_rows_in_batches(cursor, csv_file, safe_names, column_names):
+    """Carica le righe del CSV a blocchi, correggendole prima in Python.
+    
+    Le righe sistemate vengono riscritte in CSV dentro un buffer in memoria
+    e ogni blocco di BATCH_SIZE righe parte con un solo COPY. Usiamo FORMAT CSV
+    (e non copy_from) perché alcuni campi contengono virgole tra virgolette.
+    """
+    copy_sql = f"COPY utenti ({column_names}) FROM STDIN WITH (FORMAT CSV)"
+    column_count = len(safe_names)
+    total_rows = 0
+    pending = 0
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    
+    with open(csv_file, 'r', encoding='utf-8', newline='', buffering=1 << 20) as f:
+        csv_reader = csv.reader(f)
+        next(csv_reader)  # Saltiamo la riga di intestazione
+        
+        for row in csv_reader:
+            # Righe più corte vengono completate con NULL, quelle più lunghe troncate
+            if len(row) != column_count:
+                row = (row + [None] * column_count)[:column_count]
+            writer.writerow(row)
+            pending += 1
+            
+            if pending >= BATCH_SIZE:
+                buf.seek(0)
+                cursor.copy_expert(sql=copy_sql, file=buf)
+                total_rows += pending
+                logger.info(f"Caricate {total_rows} righe...")
+                buf.seek(0)
+                buf.truncate()
+                pending = 0
+    
+    # Inviamo le righe rimanenti (meno di BATCH_SIZE)
+    if pending:
+        buf.seek(0)
+        cursor.copy_expert(sql=copy_sql, file=buf)
+        total_rows += pending
+    
+    return total_rows
+
+def like_predicate(column, pattern):
+    """Traduce un pattern LIKE nella condizione PostgreSQL più specifica possibile.
+    
+    Il pattern lo conosciamo già in Python, quindi possiamo scegliere prima
+    l'operatore giusto in base alla sua forma: '%x' diventa right(col, n) = 'x',
+    'x%' left(col, n) = 'x' e '%x%' strpos(col, 'x') > 0. Tutto il resto resta un LIKE.
+    """
+    literal = pattern.strip('%')
+    # Il trucco vale solo se il testo centrale non contiene altri caratteri jolly
+    # (né il carattere di escape del LIKE)
+    if '%' in literal or '_' in literal or '\\' in literal or not literal:
+        return "{} LIKE '{}'".format(column, pattern.replace("'", "''"))
+    
+    quoted = "'{}'".format(literal.replace("'", "''"))
+    starts = pattern.startswith('%')
+    ends = pattern.endswith('%')
+    if starts and ends:
+        return f"strpos({column}, {quoted}) > 0"
+    if starts:
+        return f"right({column}, {len(literal)}) = {quoted}"
+    if ends:
+        return f"left({column}, {len(literal)}) = {quoted}"
+    return f"{column} = {quoted}"
+
+def find_email_column(safe_names):
+    """Trova la colonna che contiene le email partendo dall'intestazione del CSV.
+    
+    ROBUSTEZZA: non diamo per scontato che si chiami esattamente 'email'.
+    Lavoriamo sui nomi sanitizzati calcolati in main(), così non serve interrogare
+    information_schema e il nome restituito è già quello usato in create_table.
+    """
+    for col_name in safe_names:
+        if col_name == 'email' or 'email' in col_name or 'mail' in col_name:
+            return col_name
+    return None
+
+def count_com_emails(conn, email_col):
     """Conta quante email terminano con '.com'
     
     PARTE CRUCIALE: questa funzione implementa la query richiesta nell'esercizio.
-    L'ho resa robusta per gestire diversi possibili nomi di colonna per l'email.
+    La colonna delle email viene individuata una sola volta in main()
+    con find_email_column e ci arriva già pronta.
     """
     try:
         cursor = conn.cursor()
         logger.info("Esecuzione query per contare email che terminano con '.com'...")
         
-        # ROBUSTEZZA: Prima troviamo quale colonna contiene le email
-        # Non diamo per scontato che si chiami esattamente 'email'
-        cursor.execute("""
-            SELECT column_name 
-            FROM information_schema.columns 
-            WHERE table_name = 'utenti' 
-            AND table_schema = 'public'
-        """)
-        columns = cursor.fetchall()
-        email_col = None
-        
-        # Cerchiamo una colonna che probabilmente contiene email
-        for col in columns:
-            col_name = col[0].lower()
-            if col_name == 'email' or 'email' in col_name or 'mail' in col_name:
-                email_col = col[0]
-                break
-        
-        # Se non troviamo la colonna, impossibile procedere
+        # Se non abbiamo trovato la colonna, impossibile procedere
         if not email_col:
             logger.error("Colonna 'email' non trovata nella tabella")
             return 0
         
         # QUERY FINALE: Contiamo le email che terminano con .com
-        # Usando una query parametrizzata per sicurezza
+        # like_predicate trasforma '%.com' in right(email, 4) = '.com'.
+        # Niente indice: su poche migliaia di righe costruirlo costa molto più
+        # della scansione sequenziale che ci farebbe risparmiare
         cursor.execute(f"""
             SELECT COUNT(*) FROM utenti
-            WHERE {email_col} LIKE '%.com';
+            WHERE {like_predicate(email_col, '%.com')};
         """)
         
         # Estraggo il risultato (è un numero singolo)
@@ -192,18 +262,23 @@ def main():
         _, header = get_csv_column_count(CSV_FILE)
         logger.info(f"Il file CSV ha {len(header)} colonne")
         
+        # Sanitizziamo i nomi delle colonne UNA VOLTA SOLA (minuscolo, spazi → _):
+        # li usano la creazione della tabella, il caricamento e la ricerca della colonna email
+        safe_names = tuple(col.lower().replace(' ', '_') for col in header)
+        email_col = find_email_column(safe_names)
+        
         # Fase 2: Connessione al database
         logger.info("Connessione al database PostgreSQL...")
         conn = psycopg2.connect(**DB_PARAMS)
         
         # Fase 3: Creazione della tabella
-        create_table(conn, header)
+        create_table(conn, safe_names)
         
         # Fase 4: Caricamento dei dati
-        rows_loaded = load_csv_to_database(conn, CSV_FILE, header)
+        rows_loaded = load_csv_to_database(conn, CSV_FILE, safe_names)
         
         # Fase 5: Esecuzione della query richiesta
-        com_emails_count = count_com_emails(conn)
+        com_emails_count = count_com_emails(conn, email_col)
         
         # Fase 6: Visualizzazione dei risultati
         print("\nRISULTATI:")
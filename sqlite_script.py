@@ -27,7 +27,8 @@ DB_FILE = os.getenv('SQLITE_DB_FILE', 'utenti.db')
 # Parole riservate in SQLite
 # Ho inserito questa lista perché SQLite non permette di usare queste parole come nomi di colonne
 # Sono tutte le parole chiave del linguaggio SQL che causerebbero errori di sintassi
-RESERVED_WORDS = [
+# È un frozenset di parole già in minuscolo: il controllo "in" costa O(1)
+RESERVED_WORDS = frozenset([
     'abort', 'action', 'add', 'after', 'all', 'alter', 'analyze', 'and', 'as', 'asc',
     'attach', 'autoincrement', 'before', 'begin', 'between', 'by', 'cascade', 'case',
     'cast', 'check', 'collate', 'column', 'commit', 'conflict', 'constraint', 'create',
@@ -43,139 +44,171 @@ RESERVED_WORDS = [
     'select', 'set', 'table', 'temp', 'temporary', 'then', 'to', 'transaction', 'trigger',
     'union', 'unique', 'update', 'using', 'vacuum', 'values', 'view', 'virtual', 'when',
     'where', 'with', 'without'
-]
+])
+
+# Tabella di traduzione costruita una volta sola: spazio -> underscore
+# str.translate la applica a tutta la stringa in C
+SPACE_TO_UNDERSCORE = str.maketrans(' ', '_')
+
+def sanitize_column_name(col_name):
+    """Trasforma un nome di colonna del CSV in un nome sicuro per SQLite.
+    
+    Unico punto in cui sono definite le regole sui nomi: create_table
+    la applica una volta e restituisce i nomi a chi li deve riusare.
+    """
+    # Sanitizzo il nome della colonna: tolgo spazi, metto tutto in minuscolo
+    safe_col_name = col_name.lower().translate(SPACE_TO_UNDERSCORE)
+    
+    # PUNTO CRITICO: Se il nome è una parola riservata, aggiungiamo un suffisso
+    # Questo evita errori di sintassi SQL (es. "index" è una parola riservata)
+    if safe_col_name in RESERVED_WORDS:
+        safe_col_name = f"{safe_col_name}_col"
+    return safe_col_name
 
 def create_connection():
-    """Crea una connessione al database SQLite.
+    """Crea una connessione al database SQLite in memoria.
     
     Ho scelto di usare una funzione separata per questo perché rende il codice più
     organizzato e permette di gestire eventuali errori di connessione.
+    Il caricamento avviene tutto in RAM, il file su disco viene scritto
+    solo alla fine da save_to_disk().
     """
     try:
-        logger.info(f"Connessione al database SQLite {DB_FILE}...")
-        conn = sqlite3.connect(DB_FILE)
+        logger.info("Connessione al database SQLite in memoria...")
+        # OTTIMIZZAZIONE: ':memory:' = nessun I/O su disco durante gli INSERT
+        # isolation_level=None: gestiamo noi le transazioni con BEGIN/COMMIT espliciti
+        conn = sqlite3.connect(':memory:', isolation_level=None)
+        
+        # OTTIMIZZAZIONE: impostazioni pensate per il caricamento massivo
+        # - page_size=8192: pagine più grandi = meno pagine da allocare e da copiare
+        #   nel backup finale (va impostato prima di creare qualsiasi tabella)
+        # - journal_mode=MEMORY: il journal di rollback resta in RAM
+        # - synchronous=OFF: niente fsync a ogni commit (per un esercizio va bene)
+        # - temp_store=MEMORY: le strutture temporanee restano in RAM
+        # - cache_size=-65536: 64 MB di cache delle pagine (valore negativo = KB)
+        conn.executescript("""
+            PRAGMA page_size=8192;
+            PRAGMA journal_mode=MEMORY;
+            PRAGMA synchronous=OFF;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA cache_size=-65536;
+        """)
         logger.info("Connessione stabilita con successo.")
         return conn
     except Exception as e:
         logger.error(f"Errore durante la connessione al database: {e}")
         raise
 
-def get_csv_column_count(csv_file):
-    """Ottiene il numero di colonne dal file CSV.
+def save_to_disk(conn):
+    """Copia il database in memoria nel file DB_FILE.
     
-    Questa funzione è importante perché il nostro script deve adattarsi
-    a CSV con diverso numero di colonne.
+    Uso l'API di backup di SQLite: il database già pronto viene scritto
+    sul file in un'unica passata sequenziale, invece di far andare
+    ogni INSERT su disco durante il caricamento.
     """
+    disk = None
     try:
-        with open(csv_file, 'r', encoding='utf-8') as f:
-            csv_reader = csv.reader(f)
-            header = next(csv_reader)  # Leggiamo solo la prima riga (intestazione)
-            return len(header)
+        logger.info(f"Salvataggio del database nel file {DB_FILE}...")
+        disk = sqlite3.connect(DB_FILE, isolation_level=None)
+        
+        # Impostazioni per il file su disco:
+        # - journal_mode=DELETE: il backup scrive le pagine direttamente nel file.
+        #   Con WAL la copia passerebbe prima dal log e fallirebbe se il file
+        #   esistente ha una page_size diversa da quella del database in memoria
+        # - synchronous=OFF: niente fsync durante la copia
+        # - locking_mode=EXCLUSIVE: siamo gli unici a usare il file, niente lock ripetuti
+        # - journal_size_limit: in modalità esclusiva il journal resta sul disco,
+        #   così non può superare i 64 MB
+        disk.executescript("""
+            PRAGMA journal_mode=DELETE;
+            PRAGMA synchronous=OFF;
+            PRAGMA locking_mode=EXCLUSIVE;
+            PRAGMA journal_size_limit=67108864;
+        """)
+        
+        # PASSAGGIO CHIAVE: copia di tutte le pagine in un colpo solo.
+        # Il file prende la page_size del database in memoria
+        conn.backup(disk)
+        logger.info("Salvataggio completato.")
     except Exception as e:
-        logger.error(f"Errore durante la lettura dell'intestazione CSV: {e}")
+        logger.error(f"Errore durante il salvataggio del database su disco: {e}")
         raise
+    finally:
+        if disk:
+            disk.close()
 
-def create_table(conn, column_count):
-    """Crea la tabella nel database con il numero corretto di colonne.
+def create_table(conn, header):
+    """Crea la tabella nel database con le stesse colonne del CSV.
     
     Questa è una parte cruciale: invece di creare una tabella fissa,
-    analizziamo l'intestazione del CSV e creiamo colonne con gli stessi nomi.
+    usiamo l'intestazione del CSV e creiamo colonne con gli stessi nomi.
     Mi è capitato in passato di avere problemi con i CSV che cambiano struttura,
     quindi questo approccio rende lo script più robusto.
+    Restituisce i nomi sicuri delle colonne, che main() riusa per il
+    caricamento e per la query senza sanitizzare di nuovo l'intestazione.
     """
     try:
-        cursor = conn.cursor()
         logger.info("Creazione della tabella utenti...")
         
-        # Drop table if exists - se la tabella esiste già, la eliminiamo
-        cursor.execute("DROP TABLE IF EXISTS utenti;")
+        # L'intestazione arriva già letta da main(), non riapriamo il file
+        safe_names = [sanitize_column_name(col_name) for col_name in header]
         
-        # Creiamo la tabella con il numero corretto di colonne
-        # Prima otteniamo l'intestazione dal CSV per usare i nomi corretti
-        with open(CSV_FILE, 'r', encoding='utf-8') as f:
-            csv_reader = csv.reader(f)
-            header = next(csv_reader)
-            
-            # PASSAGGIO IMPORTANTE: Creiamo la definizione della tabella
-            # con una colonna ID aggiuntiva come chiave primaria
-            column_defs = ["id INTEGER PRIMARY KEY AUTOINCREMENT"]
-            for col_name in header:
-                # Sanitizzo il nome della colonna: tolgo spazi, metto tutto in minuscolo
-                safe_col_name = col_name.lower().replace(' ', '_')
-                
-                # PUNTO CRITICO: Se il nome è una parola riservata, aggiungiamo un suffisso
-                # Questo evita errori di sintassi SQL (es. "index" è una parola riservata)
-                if safe_col_name.lower() in [w.lower() for w in RESERVED_WORDS]:
-                    safe_col_name = f"{safe_col_name}_col"
-                
-                # Mettiamo il nome della colonna tra virgolette per sicurezza
-                column_defs.append(f'"{safe_col_name}" TEXT')
-            
-            # Costruiamo e eseguiamo la query SQL per creare la tabella
-            create_sql = f"CREATE TABLE utenti ({', '.join(column_defs)});"
-            logger.info(f"Query creazione tabella: {create_sql}")
-            cursor.execute(create_sql)
+        # PASSAGGIO IMPORTANTE: Creiamo la definizione della tabella
+        # con una colonna ID aggiuntiva come chiave primaria.
+        # Costruiamo la query SQL con un solo join, mettendo i nomi delle
+        # colonne tra virgolette per sicurezza.
+        # Lo schema è pronto prima di qualsiasi accesso al database
+        # OTTIMIZZAZIONE: INTEGER PRIMARY KEY senza AUTOINCREMENT è un alias del
+        # rowid, quindi SQLite non deve aggiornare sqlite_sequence a ogni INSERT.
+        # Facciamo solo caricamenti e mai cancellazioni, gli id restano gli stessi
+        cols_sql = "id INTEGER PRIMARY KEY, " + ', '.join(f'"{name}" TEXT' for name in safe_names)
+        create_sql = f"CREATE TABLE utenti ({cols_sql});"
+        logger.info(f"Query creazione tabella: {create_sql}")
+        
+        # Drop table if exists - se la tabella esiste già, la eliminiamo
+        conn.execute("DROP TABLE IF EXISTS utenti;")
+        conn.execute(create_sql)
         
         conn.commit()  # Confermiamo i cambiamenti nel database
-        logger.info(f"Tabella creata con successo con {column_count} colonne.")
+        logger.info(f"Tabella creata con successo con {len(safe_names)} colonne.")
+        return safe_names
     except Exception as e:
         logger.error(f"Errore durante la creazione della tabella: {e}")
         raise
 
-def load_csv_to_database(conn, csv_file):
+def load_csv_to_database(conn, csv_reader, safe_names):
     """Carica i dati dal CSV nel database SQLite.
     
     Questa è la parte più pesante in termini di calcolo.
     Ho implementato transazioni per rendere l'inserimento più veloce,
     altrimenti con file grandi potrebbe richiedere molto tempo.
+    Il lettore CSV arriva già posizionato dopo l'intestazione e i nomi
+    sicuri delle colonne sono quelli restituiti da create_table.
     """
     try:
-        cursor = conn.cursor()
-        logger.info(f"Caricamento dati dal file {csv_file}...")
+        # TECNICA IMPORTANTE: Generiamo la query INSERT dinamicamente 
+        # così funziona indipendentemente dal numero di colonne
+        placeholders = ', '.join(['?' for _ in safe_names])  # Crea la serie di ? per i parametri
+        column_names = ', '.join([f'"{name}"' for name in safe_names])
+        insert_sql = f"INSERT INTO utenti ({column_names}) VALUES ({placeholders})"
         
-        # Conta le righe per il report finale
-        total_rows = 0
+        # OTTIMIZZAZIONE: Utilizziamo le transazioni per migliorare le prestazioni
+        # Senza transazioni, ogni INSERT farebbe una scrittura su disco, molto lento.
+        # Con il database in memoria basta un'unica transazione per tutto il caricamento.
+        # BEGIN IMMEDIATE prende subito il lock di scrittura, così non c'è
+        # nessun passaggio da lock condiviso a lock esclusivo al primo INSERT
+        conn.execute("BEGIN IMMEDIATE")
         
-        with open(csv_file, 'r', encoding='utf-8') as f:
-            csv_reader = csv.reader(f)
-            header = next(csv_reader)  # Salta l'intestazione
-            
-            # PASSAGGIO CHIAVE: Generiamo nomi di colonne sicuri
-            # con lo stesso procedimento usato nella creazione della tabella
-            safe_column_names = []
-            for col_name in header:
-                # Sanitizzo il nome della colonna e gestisco le parole riservate
-                safe_col_name = col_name.lower().replace(' ', '_')
-                
-                # Se il nome è una parola riservata, aggiungiamo il suffisso
-                if safe_col_name.lower() in [w.lower() for w in RESERVED_WORDS]:
-                    safe_col_name = f"{safe_col_name}_col"
-                
-                safe_column_names.append(safe_col_name)
-            
-            # TECNICA IMPORTANTE: Generiamo la query INSERT dinamicamente 
-            # così funziona indipendentemente dal numero di colonne
-            placeholders = ', '.join(['?' for _ in header])  # Crea la serie di ? per i parametri
-            column_names = ', '.join([f'"{name}"' for name in safe_column_names])
-            insert_sql = f"INSERT INTO utenti ({column_names}) VALUES ({placeholders})"
-            
-            # OTTIMIZZAZIONE: Utilizziamo le transazioni per migliorare le prestazioni
-            # Senza transazioni, ogni INSERT farebbe una scrittura su disco, molto lento
-            conn.execute("BEGIN TRANSACTION")
-            
-            # Inseriamo ogni riga del CSV nella tabella
-            for row in csv_reader:
-                cursor.execute(insert_sql, row)
-                total_rows += 1
-                
-                # Ogni 1000 righe, facciamo commit e iniziamo una nuova transazione
-                # Questo bilancia velocità e uso di memoria
-                if total_rows % 1000 == 0:
-                    logger.info(f"Caricate {total_rows} righe...")
-                    conn.commit()
-                    conn.execute("BEGIN TRANSACTION")
+        # OTTIMIZZAZIONE: passiamo direttamente il lettore CSV a executemany.
+        # Il modulo sqlite3 prende le righe una alla volta in C e riusa la stessa
+        # istruzione preparata: niente ciclo Python e niente liste di righe in memoria.
+        # map(tuple, ...) gira in C: il modulo sqlite3 ha un percorso più rapido
+        # per i parametri passati come tuple rispetto alle liste del lettore CSV.
+        # Connection.executemany crea il cursore internamente e ce lo restituisce:
+        # con executemany, rowcount è la somma delle righe inserite
+        total_rows = conn.executemany(insert_sql, map(tuple, csv_reader)).rowcount
         
-        # Commit finale per le righe rimanenti
+        # Un solo commit alla fine del caricamento
         conn.commit()
         logger.info(f"Caricamento completato: {total_rows} righe inserite.")
         return total_rows
@@ -184,43 +217,45 @@ def load_csv_to_database(conn, csv_file):
         conn.rollback()  # Annulliamo le modifiche in caso di errore
         raise
 
-def count_https_websites(conn):
+def find_website_column(header, safe_names):
+    """Trova la colonna che contiene i siti web partendo dall'intestazione del CSV.
+    
+    OTTIMIZZAZIONE: usiamo l'intestazione già letta in main(), così non serve
+    interrogare PRAGMA table_info. Prima proviamo il nome esatto con una mappa
+    nome originale -> nome sicuro, e solo se manca facciamo la ricerca flessibile.
+    """
+    columns_by_name = {col.lower(): safe for col, safe in zip(header, safe_names)}
+    website_col = columns_by_name.get('website')
+    if website_col:
+        return website_col
+    
+    # ROBUSTEZZA: il CSV potrebbe avere nomi come 'web_site', 'site_web', ecc.
+    for safe in safe_names:
+        if 'website' in safe or 'site' in safe or 'sito' in safe:
+            return safe
+    return None
+
+def count_https_websites(conn, website_col):
     """Conta quanti link in Website iniziano con 'https://'
     
     PARTE CRUCIALE: questa è la funzione che implementa la query richiesta
-    nell'esercizio. Ho preferito un approccio flessibile che cerca la
-    colonna giusta anche se il nome non è esattamente 'website'.
+    nell'esercizio. La colonna giusta la trova find_website_column,
+    anche se il nome non è esattamente 'website'.
     """
     try:
-        cursor = conn.cursor()
         logger.info("Esecuzione query per contare website che iniziano con 'https://'...")
         
-        # PASSAGGIO IMPORTANTE: Verifichiamo prima quale colonna contiene i siti web
-        # Questo è utile perché il CSV potrebbe avere nomi di colonne diversi
-        cursor.execute("PRAGMA table_info(utenti)")
-        columns = cursor.fetchall()
-        website_col = None
-        
-        # Cerchiamo una colonna che potrebbe contenere informazioni sul sito web
-        for col in columns:
-            col_name = col[1].lower()  # Il nome della colonna è nella posizione 1
-            # Cerchiamo nomi come 'website', 'web_site', 'site_web', ecc.
-            if col_name == 'website' or 'website' in col_name or 'site' in col_name or 'sito' in col_name:
-                website_col = col[1]
-                break
-        
         # Se non troviamo la colonna, impossibile procedere
         if not website_col:
             logger.error("Colonna 'website' non trovata nella tabella")
             return 0
         
         # QUERY FINALE: Contiamo quanti siti iniziano con https://
-        cursor.execute(f"""
+        # conn.execute ci evita di creare un cursore a mano
+        (result,) = conn.execute(f"""
             SELECT COUNT(*) FROM utenti
             WHERE "{website_col}" LIKE 'https://%';
-        """)
-        
-        result = cursor.fetchone()[0]  # Prendiamo il primo valore del risultato
+        """).fetchone()
         logger.info(f"Numero di website che iniziano con 'https://': {result}")
         return result
     except Exception as e:
@@ -244,23 +279,37 @@ def main():
     
     conn = None
     try:
-        # Fase 1: Otteniamo il numero di colonne dal CSV
-        column_count = get_csv_column_count(CSV_FILE)
-        logger.info(f"Il file CSV ha {column_count} colonne")
-        
-        # Fase 2: Connessione al database
-        conn = create_connection()
-        
-        # Fase 3: Creazione dello schema della tabella
-        create_table(conn, column_count)
-        
-        # Fase 4: Caricamento dei dati dal CSV
-        rows_loaded = load_csv_to_database(conn, CSV_FILE)
+        # OTTIMIZZAZIONE: apriamo il CSV una sola volta e leggiamo l'intestazione
+        # qui, poi la passiamo a create_table e load_csv_to_database insieme
+        # al lettore già aperto. Prima il file veniva aperto tre volte.
+        # Buffer da 1 MB e newline='' come raccomandato dal modulo csv.
+        with open(CSV_FILE, 'r', encoding='utf-8', newline='', buffering=1 << 20) as f:
+            csv_reader = csv.reader(f)
+            
+            # Fase 1: Leggiamo l'intestazione del CSV
+            header = next(csv_reader)
+            logger.info(f"Il file CSV ha {len(header)} colonne")
+            
+            # Fase 2: Connessione al database
+            conn = create_connection()
+            
+            # Fase 3: Creazione dello schema della tabella
+            # PASSAGGIO CHIAVE: i nomi sicuri vengono calcolati una volta sola qui
+            safe_names = create_table(conn, header)
+            website_col = find_website_column(header, safe_names)
+            
+            # Fase 4: Caricamento dei dati dal CSV
+            # Il file l'abbiamo aperto qui, quindi è main() a dire da dove leggiamo
+            logger.info(f"Caricamento dati dal file {CSV_FILE}...")
+            rows_loaded = load_csv_to_database(conn, csv_reader, safe_names)
         
         # Fase 5: Esecuzione della query richiesta
-        https_websites_count = count_https_websites(conn)
+        https_websites_count = count_https_websites(conn, website_col)
+        
+        # Fase 6: Salvataggio del database su disco
+        save_to_disk(conn)
         
-        # Fase 6: Visualizzazione dei risultati
+        # Fase 7: Visualizzazione dei risultati
         print("\nRISULTATI:")
         print(f"Totale righe caricate: {rows_loaded}")
         print(f"Website che iniziano con 'https://': {https_websites_count}")